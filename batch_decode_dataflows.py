@@ -4,98 +4,146 @@ Decodes all dataflow definition files in a directory,
 creating a subdirectory for each file with decoded parts
 
 Usage:
-    python batch_decode_dataflows.py <source_directory>
+    python batch_decode_dataflows.py <source_directory> [--aggregate | --no-aggregate]
+
+    --aggregate also writes definition_decoded.json (all decoded parts) into
+    each subdirectory; it is skipped by default.
 
 Example:
     python batch_decode_dataflows.py "C:\\path\\to\\dataflows"
     python batch_decode_dataflows.py "PIE_WORKSPACES"
+    python batch_decode_dataflows.py "PIE_WORKSPACES" --aggregate
 """
 
-import json
 import base64
+import contextlib
+import mmap
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+from dataflow_utils import PROGRESS_BATCH_SIZE, flush_progress, json_dumps, json_loads
+
+
+def _indent(data, level):
+    """Shift serialized JSON bytes right by `level` spaces so they can be nested."""
+    return data.replace(b'\n', b'\n' + b' ' * level)
+
 
-def decode_dataflow_definition(input_file, output_dir):
+def _part_entry(path, payload_bytes, payload_type):
+    """Serialize a decoded part entry around an already-serialized payload."""
+    return b''.join([
+        b'{\n  "path": ', json_dumps(path),
+        b',\n  "payload": ', _indent(payload_bytes, 2),
+        b',\n  "payloadType": ', json_dumps(payload_type),
+        b'\n}'
+    ])
+
+
+def _load_file(path):
+    """Parse a JSON file through a read-only memory map instead of reading it into a buffer."""
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped; let the parser report them
+            return json_loads(f.read())
+        with mm, memoryview(mm) as view:
+            return json_loads(view)
+
+
+def decode_dataflow_definition(input_file, output_dir, aggregate=False):
     """
     Decode base64-encoded dataflow definition.
     
     Args:
         input_file: Path to the encoded JSON file
         output_dir: Directory to save decoded files
+        aggregate: Also write definition_decoded.json with every decoded part
+    
+    Returns:
+        List of error messages for parts that could not be decoded
     """
     # Read the encoded file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        definition = json.load(f)
+    definition = _load_file(input_file)
     
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
-    decoded_parts = []
+    part_errors = []
     
-    # Decode each part
-    for part in definition.get('definition', {}).get('parts', []):
-        path = part.get('path')
-        payload = part.get('payload')
-        payload_type = part.get('payloadType')
+    # When requested, stream the complete decoded definition part by part, so
+    # each payload is serialized once and never held alongside the rest of the parts
+    aggregate_file = os.path.join(output_dir, "definition_decoded.json")
+    with (open(aggregate_file, 'wb') if aggregate else contextlib.nullcontext()) as agg:
+        if agg:
+            agg.write(b'{\n  "definition": {\n    "parts": [')
+        part_count = 0
         
-        if payload_type == 'InlineBase64' and payload:
-            try:
-                # Decode base64
-                decoded_bytes = base64.b64decode(payload)
-                decoded_text = decoded_bytes.decode('utf-8')
-                
-                # Parse JSON if it's a .json file
-                if path.endswith('.json'):
-                    decoded_payload = json.loads(decoded_text)
-                    new_payload_type = 'DecodedJSON'
+        # Part paths are relative file names, so plain concatenation is
+        # enough and avoids os.path.join's work on every part
+        output_prefix = os.fspath(output_dir) + os.sep
+        
+        # Decode each part; only inline base64 parts need their path looked at
+        parts = definition.get('definition', {}).get('parts', ())
+        for part in parts:
+            payload_type = part.get('payloadType')
+            payload = part.get('payload')
+            entry = None
+            
+            if payload_type == 'InlineBase64' and payload:
+                path = part.get('path')
+                try:
+                    is_json = path.endswith('.json')
                     
-                    # Save as formatted JSON file
-                    output_file = os.path.join(output_dir, path)
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump(decoded_payload, f, indent=2, ensure_ascii=False)
+                    # Decode base64 (kept as bytes; both parsers accept bytes)
+                    decoded_bytes = base64.b64decode(payload)
                     
-                else:
-                    # Keep as text (M code, etc.)
-                    decoded_payload = decoded_text
-                    new_payload_type = 'DecodedText'
+                    # Parse JSON if it's a .json file
+                    if is_json:
+                        payload_bytes = json_dumps(json_loads(decoded_bytes))
+                        new_payload_type = 'DecodedJSON'
+                        
+                        # Save as formatted JSON file
+                        output_file = output_prefix + path
+                        with open(output_file, 'wb') as f:
+                            f.write(payload_bytes)
+                        
+                    else:
+                        # Keep as text (M code, etc.)
+                        new_payload_type = 'DecodedText'
+                        
+                        # Save the decoded bytes as-is, before any aggregate-only
+                        # work, so --aggregate never changes which files get written
+                        output_file = output_prefix + path
+                        with open(output_file, 'wb') as f:
+                            f.write(decoded_bytes)
+                        
+                        if agg:
+                            payload_bytes = json_dumps(decoded_bytes.decode('utf-8'))
                     
-                    # Save as text file
-                    output_file = os.path.join(output_dir, path)
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        f.write(decoded_text)
-                
-                decoded_parts.append({
-                    'path': path,
-                    'payload': decoded_payload,
-                    'payloadType': new_payload_type
-                })
-                
-            except Exception as e:
-                print(f"   ❌ Error decoding {path}: {e}")
-                decoded_parts.append(part)
-        else:
-            decoded_parts.append(part)
-    
-    # Save complete decoded definition
-    decoded_definition = {
-        'definition': {
-            'parts': decoded_parts
-        }
-    }
-    
-    output_file = os.path.join(output_dir, "definition_decoded.json")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(decoded_definition, f, indent=2, ensure_ascii=False)
+                    if agg:
+                        entry = _part_entry(path, payload_bytes, new_payload_type)
+                    
+                except Exception as e:
+                    part_errors.append(f"Error decoding {path}: {e}")
+            
+            if agg:
+                if entry is None:
+                    entry = json_dumps(part)
+                agg.write(b',\n      ' if part_count else b'\n      ')
+                agg.write(_indent(entry, 6))
+                part_count += 1
+        
+        if agg:
+            agg.write(b'\n    ]\n  }\n}' if part_count else b']\n  }\n}')
     
     # Move original file to the directory
-    import shutil
     moved_file = os.path.join(output_dir, os.path.basename(input_file))
-    shutil.copy2(input_file, moved_file)
+    os.replace(input_file, moved_file)
     
-    return decoded_definition
+    return part_errors
 
 
 def extract_metadata_from_filename(filename):
@@ -130,13 +178,37 @@ def extract_metadata_from_filename(filename):
     return None
 
 
-def batch_decode_directory(source_dir):
+def _decode_one(json_file, output_dir, idx, aggregate=False):
+    """
+    Decode a single export file into its item directory.
+    Runs in a worker process, so it reports back instead of raising.
+    
+    Returns:
+        Tuple of (idx, filename, metadata, ok, error message, part errors)
+    """
+    json_file = Path(json_file)
+    try:
+        # Decode the file
+        part_errors = decode_dataflow_definition(str(json_file), str(output_dir), aggregate)
+        
+        # Extract metadata from filename
+        metadata = extract_metadata_from_filename(json_file.name)
+        
+        return idx, json_file.name, metadata, True, None, part_errors
+    
+    except Exception as e:
+        return idx, json_file.name, None, False, str(e), []
+
+
+def batch_decode_directory(source_dir, aggregate=False):
     """
     Process all JSON files in a directory.
     For each file, create a subdirectory and decode into it.
+    Files are decoded in parallel across worker processes.
     
     Args:
         source_dir: Directory containing encoded JSON files
+        aggregate: Also write definition_decoded.json into each subdirectory
     """
     source_path = Path(source_dir)
     
@@ -160,40 +232,61 @@ def batch_decode_directory(source_dir):
     success_count = 0
     error_count = 0
     
-    for idx, json_file in enumerate(json_files, 1):
-        # Use short numbered directory names to avoid Windows MAX_PATH issues
-        # Format: item_001, item_002, etc.
-        output_dir = source_path / f"item_{idx:03d}"
-        
-        # Create a mapping file to track which item corresponds to which file
-        mapping_file = source_path / "item_mapping.txt"
-        
-        print(f"[{idx}/{len(json_files)}] Processing: {json_file.name}")
-        
-        try:
-            # Decode the file
-            decode_dataflow_definition(str(json_file), str(output_dir))
+    # (item number, mapping line) pairs, written in one pass at the end
+    mapping_lines = []
+    
+    # Bound the pool so a large workspace doesn't thrash the disk
+    max_workers = min(os.cpu_count() or 1, len(json_files), 32)
+    
+    progress = []
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Use short numbered directory names to avoid Windows MAX_PATH issues
+            # Format: item_001, item_002, etc.
+            futures = {
+                executor.submit(_decode_one, str(json_file), str(source_path / f"item_{idx:03d}"), idx, aggregate): (idx, json_file.name)
+                for idx, json_file in enumerate(json_files, 1)
+            }
             
-            # Extract metadata from filename
-            metadata = extract_metadata_from_filename(json_file.name)
+            for completed, future in enumerate(as_completed(futures), 1):
+                try:
+                    idx, filename, metadata, ok, err, part_errors = future.result()
+                except Exception as e:
+                    # The worker itself died (e.g. BrokenProcessPool)
+                    idx, filename = futures[future]
+                    metadata, ok, err, part_errors = None, False, str(e) or type(e).__name__, []
+                output_dir = source_path / f"item_{idx:03d}"
             
-            # Create/append to mapping file with full metadata
-            with open(mapping_file, 'a', encoding='utf-8') as f:
-                if metadata:
-                    f.write(f"item_{idx:03d} | WorkspaceID: {metadata['workspace_id']} | ItemID: {metadata['item_id']} | Name: {metadata['name']} | Type: {metadata['type']} | File: {json_file.name}\n")
+                progress.append(f"[{idx}/{len(json_files)}] Processing: {filename}")
+                progress.extend(f"   ❌ {msg}" for msg in part_errors)
+                
+                if ok:
+                    # Record mapping entry with full metadata
+                    if metadata:
+                        mapping_lines.append((idx, f"item_{idx:03d} | WorkspaceID: {metadata['workspace_id']} | ItemID: {metadata['item_id']} | Name: {metadata['name']} | Type: {metadata['type']} | File: {filename}\n"))
+                    else:
+                        mapping_lines.append((idx, f"item_{idx:03d} -> {filename}\n"))
+                    
+                    progress.append(f"   ✅ Decoded to: {output_dir}")
+                    progress.append(f"   ✅ Original file moved to subdirectory\n")
+                    success_count += 1
                 else:
-                    f.write(f"item_{idx:03d} -> {json_file.name}\n")
-            
-            # Delete original file after successful decode
-            json_file.unlink()
-            
-            print(f"   ✅ Decoded to: {output_dir}")
-            print(f"   ✅ Original file moved to subdirectory\n")
-            success_count += 1
-            
-        except Exception as e:
-            print(f"   ❌ Error: {e}\n")
-            error_count += 1
+                    progress.append(f"   ❌ Error: {err}\n")
+                    error_count += 1
+                
+                if completed % PROGRESS_BATCH_SIZE == 0:
+                    flush_progress(progress)
+    
+    finally:
+        flush_progress(progress)
+        
+        # Create/append to mapping file to track which item corresponds to which
+        # file; done even if the run is interrupted, since decoded inputs have
+        # already been moved into their item directories
+        if mapping_lines:
+            mapping_file = source_path / "item_mapping.txt"
+            with open(mapping_file, 'a', encoding='utf-8') as f:
+                f.writelines(line for _, line in sorted(mapping_lines))
     
     print(f"\n{'='*70}")
     print(f"BATCH DECODE COMPLETE")
@@ -208,14 +301,23 @@ def batch_decode_directory(source_dir):
 
 def main():
     """Command-line entry point."""
-    if len(sys.argv) < 2:
+    args = [arg for arg in sys.argv[1:] if arg not in ('--aggregate', '--no-aggregate')]
+    if not args:
         print(__doc__)
         print("\nError: Missing required argument")
-        print("Usage: python batch_decode_dataflows.py <source_directory>")
+        print("Usage: python batch_decode_dataflows.py <source_directory> [--aggregate | --no-aggregate]")
         sys.exit(1)
     
-    source_dir = sys.argv[1]
-    success = batch_decode_directory(source_dir)
+    # The last of --aggregate/--no-aggregate wins; default is off
+    aggregate = False
+    for arg in sys.argv[1:]:
+        if arg == '--aggregate':
+            aggregate = True
+        elif arg == '--no-aggregate':
+            aggregate = False
+    
+    source_dir = args[0]
+    success = batch_decode_directory(source_dir, aggregate)
     sys.exit(0 if success else 1)
 
 
@@ -3,9 +3,8 @@ Create Power Query Template (.pqt) files from decoded Fabric Dataflow workspace
 
 This script automates the process of:
 1. Identifying dataflow items (those with mashup.pq files)
-2. Creating pqtzip directory structures with required template files
-3. Generating .pqt archive files
-4. Creating item_mapping.txt for traceability
+2. Generating .pqt archive files with the required template files
+3. Creating item_mapping.txt for traceability
 
 Usage:
     python create_pqt_from_workspace.py <source_workspace_path> [output_directory]
@@ -17,12 +16,18 @@ Example:
 
 import os
 import sys
-import json
 import shutil
 import zipfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
+
+from dataflow_utils import PROGRESS_BATCH_SIZE, flush_progress, json_dumps, json_loads
+
+
+# Worker threads used for the per-item .pqt archive step
+MAX_WORKERS = 8
 
 
 def find_dataflow_items(workspace_path: Path) -> List[Path]:
@@ -33,11 +38,15 @@ def find_dataflow_items(workspace_path: Path) -> List[Path]:
         print(f"Error: Workspace path does not exist: {workspace_path}")
         return dataflow_items
     
-    for item_dir in sorted(workspace_path.iterdir()):
-        if item_dir.is_dir() and item_dir.name.startswith("item_"):
-            mashup_file = item_dir / "mashup.pq"
-            if mashup_file.exists():
-                dataflow_items.append(item_dir)
+    # os.scandir caches the entry type, avoiding a stat() per entry.
+    # Filter first and sort only the matching items, keeping output order stable.
+    with os.scandir(workspace_path) as entries:
+        dataflow_items = [
+            Path(entry.path) for entry in entries
+            if entry.is_dir() and entry.name.startswith("item_")
+            and os.path.exists(os.path.join(entry.path, "mashup.pq"))
+        ]
+    dataflow_items.sort(key=lambda p: p.name)
     
     print(f"Found {len(dataflow_items)} dataflow items in {workspace_path}")
     return dataflow_items
@@ -67,17 +76,14 @@ def read_item_mapping(workspace_path: Path) -> Dict[str, str]:
 
 def create_mashup_metadata(query_metadata_path: Path) -> Dict:
     """Transform queryMetadata.json to MashupMetadata.json format."""
-    with open(query_metadata_path, 'r', encoding='utf-8') as f:
-        query_metadata = json.load(f)
+    with open(query_metadata_path, 'rb') as f:
+        query_metadata = json_loads(f.read())
     
     # Transform nested queriesMetadata object to QueriesMetadata array
-    queries_metadata = []
-    if "queriesMetadata" in query_metadata:
-        for query_name, query_info in query_metadata["queriesMetadata"].items():
-            query_entry = {"Name": query_name}
-            if "isHidden" in query_info:
-                query_entry["IsHidden"] = query_info["isHidden"]
-            queries_metadata.append(query_entry)
+    queries_metadata = [
+        {"Name": query_name, **({"IsHidden": query_info["isHidden"]} if "isHidden" in query_info else {})}
+        for query_name, query_info in query_metadata.get("queriesMetadata", {}).items()
+    ]
     
     mashup_metadata = {
         "Version": "1.0.0.0",
@@ -89,8 +95,8 @@ def create_mashup_metadata(query_metadata_path: Path) -> Dict:
 
 def create_metadata(platform_path: Path) -> Dict:
     """Create Metadata.json from .platform file."""
-    with open(platform_path, 'r', encoding='utf-8') as f:
-        platform_data = json.load(f)
+    with open(platform_path, 'rb') as f:
+        platform_data = json_loads(f.read())
     
     display_name = platform_data.get("config", {}).get("displayName", "Dataflow")
     
@@ -112,65 +118,62 @@ def create_content_types_xml() -> str:
 </Types>'''
 
 
-def create_pqtzip_structure(item_dir: Path) -> bool:
-    """Create pqtzip directory with all required template files."""
-    pqtzip_dir = item_dir / "pqtzip"
-    pqtzip_dir.mkdir(exist_ok=True)
-    
-    try:
-        # 1. Copy mashup.pq to MashupDocument.pq
-        mashup_src = item_dir / "mashup.pq"
-        mashup_dest = pqtzip_dir / "MashupDocument.pq"
-        shutil.copy2(mashup_src, mashup_dest)
-        
-        # 2. Create MashupMetadata.json from queryMetadata.json
-        query_metadata_path = item_dir / "queryMetadata.json"
-        if query_metadata_path.exists():
-            mashup_metadata = create_mashup_metadata(query_metadata_path)
-            with open(pqtzip_dir / "MashupMetadata.json", 'w', encoding='utf-8') as f:
-                json.dump(mashup_metadata, f, indent=2)
-        
-        # 3. Create Metadata.json from .platform
-        platform_path = item_dir / ".platform"
-        if platform_path.exists():
-            metadata = create_metadata(platform_path)
-            with open(pqtzip_dir / "Metadata.json", 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=2)
-        
-        # 4. Create [Content_Types].xml
-        content_types_xml = create_content_types_xml()
-        with open(pqtzip_dir / "[Content_Types].xml", 'w', encoding='utf-8') as f:
-            f.write(content_types_xml)
-        
-        return True
-    
-    except Exception as e:
-        print(f"Error creating pqtzip for {item_dir.name}: {e}")
-        return False
+# The content types document is identical for every item, so encode it once
+_CONTENT_TYPES_XML_BYTES = create_content_types_xml().encode('utf-8')
 
 
-def create_pqt_archive(item_dir: Path) -> bool:
-    """Create .pqt archive file from pqtzip directory."""
-    pqtzip_dir = item_dir / "pqtzip"
+def build_pqt(item_dir: Path) -> bool:
+    """Create the .pqt archive for an item, writing template files straight into the ZIP."""
     pqt_file = item_dir / f"{item_dir.name}.pqt"
-    
-    if not pqtzip_dir.exists():
-        print(f"Error: pqtzip directory does not exist for {item_dir.name}")
-        return False
+    # Build into a new file and swap it in, so an existing .pqt (possibly a
+    # hardlink shared with the source item) is never rewritten in place
+    tmp_file = item_dir / f"{item_dir.name}.pqt.tmp"
     
     try:
-        with zipfile.ZipFile(pqt_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in pqtzip_dir.iterdir():
-                if file_path.is_file():
-                    zipf.write(file_path, file_path.name)
+        # Fast compression for the mashup document; the small metadata files
+        # are stored uncompressed since deflating them saves next to nothing
+        with zipfile.ZipFile(tmp_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+            # 1. Add mashup.pq as MashupDocument.pq
+            zipf.write(item_dir / "mashup.pq", "MashupDocument.pq")
+            
+            # 2. Create MashupMetadata.json from queryMetadata.json
+            query_metadata_path = item_dir / "queryMetadata.json"
+            if query_metadata_path.exists():
+                mashup_metadata = create_mashup_metadata(query_metadata_path)
+                zipf.writestr("MashupMetadata.json", json_dumps(mashup_metadata), compress_type=zipfile.ZIP_STORED)
+            
+            # 3. Create Metadata.json from .platform
+            platform_path = item_dir / ".platform"
+            if platform_path.exists():
+                metadata = create_metadata(platform_path)
+                zipf.writestr("Metadata.json", json_dumps(metadata), compress_type=zipfile.ZIP_STORED)
+            
+            # 4. Create [Content_Types].xml
+            zipf.writestr("[Content_Types].xml", _CONTENT_TYPES_XML_BYTES, compress_type=zipfile.ZIP_STORED)
         
+        os.replace(tmp_file, pqt_file)
         return True
     
     except Exception as e:
         print(f"Error creating .pqt archive for {item_dir.name}: {e}")
+        # Don't leave a partial or stale archive behind to be treated as a
+        # dataflow; unlinking only drops this directory's entry, never a
+        # shared source file's contents
+        for path in (tmp_file, pqt_file):
+            if path.exists():
+                path.unlink()
         return False
 
 
+def find_workspace_file(item_dir: Path) -> Optional[str]:
+    """Return the name of the first WS__*.json file in an item directory, if any."""
+    with os.scandir(item_dir) as entries:
+        return next(
+            (e.name for e in entries if e.name.startswith("WS__") and e.name.endswith(".json")),
+            None
+        )
+
+
 def create_output_mapping(dataflow_items: List[Path], original_mappings: Dict[str, str], output_path: Path) -> bool:
     """Create item_mapping.txt in the output directory with workspace IDs and metadata."""
     mapping_file = output_path / "item_mapping.txt"
@@ -181,12 +184,11 @@ def create_output_mapping(dataflow_items: List[Path], original_mappings: Dict[st
                 item_id = item_dir.name
                 
                 # Find the WS__*.json file to extract workspace information
-                ws_files = list(item_dir.glob("WS__*.json"))
+                ws_filename = find_workspace_file(item_dir)
                 
-                if ws_files:
+                if ws_filename:
                     # Parse the workspace file name: WS__<workspace-id>__<item-id>__<name>__<type>.json
-                    ws_filename = ws_files[0].name  # Get full filename with .json
-                    ws_stem = ws_files[0].stem  # Remove .json extension for parsing
+                    ws_stem = ws_filename[:-len(".json")]  # Remove .json extension for parsing
                     parts = ws_stem.split('__')
                     
                     if len(parts) >= 5:
@@ -213,6 +215,15 @@ def create_output_mapping(dataflow_items: List[Path], original_mappings: Dict[st
         return False
 
 
+def _fast_copy(src: str, dst: str) -> str:
+    """Hardlink src to dst, falling back to a regular copy (e.g. across volumes)."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
 def copy_dataflow_items(dataflow_items: List[Path], output_path: Path) -> List[Path]:
     """Copy dataflow item directories to output location."""
     # If output path is the same as source, don't copy - work in place
@@ -227,9 +238,13 @@ def copy_dataflow_items(dataflow_items: List[Path], output_path: Path) -> List[P
     for item_dir in dataflow_items:
         dest_dir = output_path / item_dir.name
         
-        # Copy the entire item directory if it doesn't exist
+        # Copy the entire item directory if it doesn't exist.
+        # Files are hardlinked when possible, so anything written into the
+        # copy must replace files rather than rewrite them; existing .pqt
+        # archives are skipped since build_pqt regenerates them anyway.
         if not dest_dir.exists():
-            shutil.copytree(item_dir, dest_dir)
+            shutil.copytree(item_dir, dest_dir, copy_function=_fast_copy,
+                            ignore=shutil.ignore_patterns('*.pqt'))
             copied_items.append(dest_dir)
         else:
             copied_items.append(dest_dir)
@@ -280,36 +295,26 @@ def process_workspace(source_workspace: str, output_directory: str = None) -> bo
         print(f"\nCopying {len(dataflow_items)} dataflow items to {output_path}...")
     copied_items = copy_dataflow_items(dataflow_items, output_path)
     
-    # Step 4: Create pqtzip structures
-    print(f"\nCreating pqtzip structures...")
-    success_count = 0
-    for item_dir in copied_items:
-        if create_pqtzip_structure(item_dir):
-            success_count += 1
-            print(f"  ✓ {item_dir.name}")
-        else:
-            print(f"  ✗ {item_dir.name} - Failed")
-    
-    print(f"\nSuccessfully created {success_count}/{len(copied_items)} pqtzip structures")
-    
-    # Step 5: Create .pqt archive files
+    # Step 4: Create .pqt archive files (items are independent, so run concurrently)
     print(f"\nCreating .pqt archive files...")
-    pqt_success_count = 0
-    for item_dir in copied_items:
-        if create_pqt_archive(item_dir):
-            pqt_success_count += 1
-            print(f"  ✓ {item_dir.name}.pqt")
-        else:
-            print(f"  ✗ {item_dir.name}.pqt - Failed")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(build_pqt, copied_items))
+    
+    pqt_success_count = sum(results)
+    flush_progress([
+        f"  ✓ {item_dir.name}.pqt" if ok else f"  ✗ {item_dir.name}.pqt - Failed"
+        for item_dir, ok in zip(copied_items, results)
+    ])
     
     print(f"\nSuccessfully created {pqt_success_count}/{len(copied_items)} .pqt files")
     
-    # Step 6: Move items with .pqt files to with_dataflows directory
+    # Step 5: Move items with .pqt files to with_dataflows directory
     with_dataflows_path = output_path / "with_dataflows"
     with_dataflows_path.mkdir(exist_ok=True)
     
     moved_items = []
     failed_moves = []
+    progress = []
     print(f"\nMoving items with .pqt files to with_dataflows...")
     
     for item_dir in copied_items:
@@ -323,14 +328,16 @@ def process_workspace(source_workspace: str, output_directory: str = None) -> bo
             
             for attempt in range(max_retries):
                 try:
-                    # Remove destination if it exists
+                    # Remove destination if it exists (os.replace cannot
+                    # overwrite a non-empty directory)
                     if dest_dir.exists():
                         shutil.rmtree(dest_dir)
                     
-                    # Move the entire directory
-                    shutil.move(str(item_dir), str(dest_dir))
+                    # Move the entire directory; with_dataflows lives under the
+                    # same output directory, so this is a same-volume rename
+                    os.replace(str(item_dir), str(dest_dir))
                     moved_items.append(dest_dir)
-                    print(f"  ✓ Moved {item_dir.name} to with_dataflows/")
+                    progress.append(f"  ✓ Moved {item_dir.name} to with_dataflows/")
                     break
                     
                 except PermissionError as e:
@@ -340,24 +347,28 @@ def process_workspace(source_workspace: str, output_directory: str = None) -> bo
                         retry_delay *= 2  # Exponential backoff
                     else:
                         # Final attempt failed, log and continue
-                        print(f"  ✗ Failed to move {item_dir.name}: {e}")
+                        progress.append(f"  ✗ Failed to move {item_dir.name}: {e}")
                         failed_moves.append(item_dir.name)
                         break
                 except Exception as e:
-                    print(f"  ✗ Error moving {item_dir.name}: {e}")
+                    progress.append(f"  ✗ Error moving {item_dir.name}: {e}")
                     failed_moves.append(item_dir.name)
                     break
+            
+            if len(progress) >= PROGRESS_BATCH_SIZE:
+                flush_progress(progress)
     
+    flush_progress(progress)
     print(f"\nSuccessfully moved {len(moved_items)}/{pqt_success_count} items to with_dataflows/")
     if failed_moves:
         print(f"Failed to move {len(failed_moves)} items: {', '.join(failed_moves)}")
         print(f"These items remain in the main output directory.")
     
-    # Step 7: Create item_mapping.txt in with_dataflows directory
+    # Step 6: Create item_mapping.txt in with_dataflows directory
     if moved_items:
         create_output_mapping(moved_items, original_mappings, with_dataflows_path)
     
-    # Step 8: Create item_mapping.txt in main output directory for remaining items
+    # Step 7: Create item_mapping.txt in main output directory for remaining items
     remaining_items = [item for item in copied_items if (output_path / item.name).exists()]
     if remaining_items:
         print(f"\nCreating item_mapping.txt for {len(remaining_items)} items in main directory...")
@@ -369,7 +380,6 @@ def process_workspace(source_workspace: str, output_directory: str = None) -> bo
     print(f"{'='*70}")
     print(f"Total items processed: {len(copied_items)}")
     print(f"Items with dataflows (.pq files): {len(dataflow_items)}")
-    print(f"  - pqtzip structures created: {success_count}")
     print(f"  - .pqt archives created: {pqt_success_count}")
     print(f"  - Moved to with_dataflows/: {len(moved_items)}")
     print(f"Items without dataflows: {len(remaining_items)}")
@@ -378,7 +388,7 @@ def process_workspace(source_workspace: str, output_directory: str = None) -> bo
         print(f"Dataflows location: {with_dataflows_path}")
     print(f"{'='*70}\n")
     
-    return success_count > 0 and pqt_success_count > 0
+    return pqt_success_count > 0
 
 
 def main():
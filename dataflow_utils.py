@@ -0,0 +1,44 @@
+"""
+Shared helpers for the dataflow scripts.
+
+batch_decode_dataflows.py and create_pqt_from_workspace.py both import
+from here; keep this module free of anything specific to either script.
+"""
+
+import json
+import sys
+
+# Prefer orjson for parsing/serializing when available; fall back to stdlib json
+try:
+    import orjson
+
+    def json_loads(data):
+        """Parse JSON from bytes, str or a memoryview."""
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        """Serialize to UTF-8 JSON bytes with 2-space indentation."""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+except ImportError:
+    def json_loads(data):
+        """Parse JSON from bytes, str or a memoryview."""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def json_dumps(obj):
+        """Serialize to UTF-8 JSON bytes with 2-space indentation."""
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+# Per-item status lines are buffered and written to stdout in batches of this size
+PROGRESS_BATCH_SIZE = 50
+
+
+def flush_progress(lines):
+    """Write buffered status lines to stdout in one call and clear the buffer."""
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')
+        sys.stdout.flush()
+        lines.clear()
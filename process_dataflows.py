@@ -16,6 +16,9 @@ Usage:
     
     # Specify custom output directory for convert step
     python process_dataflows.py --all <source_directory> --output <output_directory>
+    
+    # Also write definition_decoded.json during the decode step
+    python process_dataflows.py --decode <source_directory> --aggregate
 
 Examples:
     # Complete workflow (decode + convert)
@@ -35,10 +38,8 @@ import sys
 import argparse
 from pathlib import Path
 
-# Import functions from other scripts
+# Make the other scripts importable; each is imported only when its step runs
 sys.path.insert(0, str(Path(__file__).parent))
-from batch_decode_dataflows import batch_decode_directory
-from create_pqt_from_workspace import process_workspace
 
 
 def main():
@@ -89,6 +90,21 @@ Examples:
         help='Output directory for .pqt files (default: works in-place)'
     )
     
+    # Optional aggregate decoded definition (decode step)
+    parser.add_argument(
+        '--aggregate',
+        dest='aggregate',
+        action='store_true',
+        help='Also write definition_decoded.json with all decoded parts for each item'
+    )
+    parser.add_argument(
+        '--no-aggregate',
+        dest='aggregate',
+        action='store_false',
+        help='Skip writing definition_decoded.json (default)'
+    )
+    parser.set_defaults(aggregate=False)
+    
     # Parse arguments
     args = parser.parse_args()
     
@@ -107,7 +123,8 @@ Examples:
         print("STEP 1: DECODING DATAFLOW EXPORTS")
         print("="*70)
         
-        decode_success = batch_decode_directory(str(source_path))
+        from batch_decode_dataflows import batch_decode_directory
+        decode_success = batch_decode_directory(str(source_path), args.aggregate)
         
         if not decode_success:
             print("\n❌ Decode step failed")
@@ -127,6 +144,7 @@ Examples:
         convert_source = str(source_path)
         convert_output = args.output if args.output else None
         
+        from create_pqt_from_workspace import process_workspace
         convert_success = process_workspace(convert_source, convert_output)
         
         if not convert_success: